@@ -1,48 +1,136 @@
+import asyncio
 import re
 import time
 import os
 import json
 from typing import List, Dict, Any, Optional, Tuple
 
-from gateway.store import rate_allow, quota_consume
+from collections import OrderedDict
+
+from gateway.store import (
+    rate_allow,
+    token_bucket_allow,
+    token_bucket_borrow,
+    quota_consume,
+    quota_refund,
+    current_month,
+)
+
+try:
+    import re2  # google-re2: linear-time DFA matching, immune to ReDoS
+except Exception:
+    re2 = None
+
+try:
+    import orjson  # much faster serialization, emits bytes directly
+except Exception:
+    orjson = None
+
+try:
+    import hyperscan  # SIMD multi-pattern DFA; fastest for many patterns
+except Exception:
+    hyperscan = None
+
+# Ops can force a specific engine (e.g. for A/B comparison); default is
+# the fastest one importable: hyperscan, then re2, then stdlib re.
+_REGEX_ENGINE = os.getenv("GATEWAY_REGEX_ENGINE") or (
+    "hyperscan" if hyperscan else ("re2" if re2 else "re")
+)
 
 
 class RateLimiter:
     """Redis-backed rate limiter wrapper.
 
-    This class delegates to `gateway.store.rate_allow` which performs a
-    fixed-window counter in Redis. Instances hold a reference to the
+    This class delegates to the atomic helpers in `gateway.store`.
+    Policies choose the algorithm per tenant/route: the default is a
+    fixed-window counter (`gateway.store.rate_allow`); setting
+    `algorithm: token_bucket` uses `gateway.store.token_bucket_allow`
+    for smoother burst behavior. Instances hold a reference to the
     Redis client provided by the app and expose a small `allow` method
     compatible with the previous in-memory API.
     """
 
+    # cap on locally tracked tenants; least-recently-used entries are
+    # evicted beyond this
+    LOCAL_MAX_TENANTS = 10_000
+
     def __init__(self, redis_client):
         self.redis = redis_client
+        # tenant -> [prepaid_tokens, deny_until_monotonic]; lets most
+        # token-bucket decisions complete without a Redis round trip
+        self._local: "OrderedDict[str, list]" = OrderedDict()
 
     async def allow(self, tenant: str, cfg: Dict[str, Any]) -> Tuple[bool, int]:
         """Check whether tenant can make a request under `cfg`.
 
         Args:
             tenant: tenant id string
-            cfg: dict with `requests` and `per_seconds` keys
+            cfg: dict with `requests` and `per_seconds` keys, optional
+                `algorithm` ("fixed_window" or "token_bucket"),
+                `burst` and `local_batch` (token_bucket only)
 
         Returns:
             (allowed: bool, retry_after_seconds: int)
         """
         reqs = int(cfg.get("requests", 60))
         per = int(cfg.get("per_seconds", 60))
+        if cfg.get("algorithm") == "token_bucket":
+            burst = int(cfg.get("burst", reqs))
+            batch = int(cfg.get("local_batch", max(1, min(burst, reqs // 10))))
+            if batch <= 1:
+                return await token_bucket_allow(self.redis, tenant, reqs, per, burst)
+            return await self._allow_local_bucket(tenant, reqs, per, burst, batch)
         return await rate_allow(self.redis, tenant, reqs, per)
 
+    async def _allow_local_bucket(self, tenant: str, reqs: int, per: int, burst: int, batch: int) -> Tuple[bool, int]:
+        """Token-bucket check with a process-local fast path.
+
+        Tokens are borrowed from the shared Redis bucket in batches and
+        spent locally, so only roughly 1 in `batch` requests pays the
+        round trip; the global rate is still enforced by Redis since
+        every granted token came out of the shared bucket. Denials are
+        also cached until the retry deadline (monotonic clock), so a
+        tenant hammering past its limit doesn't hammer Redis either.
+        """
+        now = time.monotonic()
+        entry = self._local.get(tenant)
+        if entry is not None:
+            self._local.move_to_end(tenant)
+            if entry[0] > 0:
+                entry[0] -= 1
+                return True, 0
+            if entry[1] > now:
+                return False, max(1, int(entry[1] - now))
+        granted, retry = await token_bucket_borrow(self.redis, tenant, reqs, per, burst, batch)
+        if entry is None:
+            entry = self._local[tenant] = [0, 0.0]
+            while len(self._local) > self.LOCAL_MAX_TENANTS:
+                self._local.popitem(last=False)
+        if granted > 0:
+            entry[0] = granted - 1
+            entry[1] = 0.0
+            return True, 0
+        entry[1] = now + retry
+        return False, retry
+
 
 class QuotaManager:
     """Redis-backed monthly quota manager.
 
     Uses an atomic Lua script in `gateway.store.quota_consume` to ensure
     multiple replicas don't oversubscribe the tenant's monthly token cap.
+    To avoid one Redis round trip per request, tokens are reserved from
+    Redis in chunks and spent from a process-local pool; unused
+    reservations are returned on shutdown via `close()`.
     """
 
+    # minimum tokens reserved from Redis per round trip
+    RESERVE_CHUNK = 4096
+
     def __init__(self, redis_client):
         self.redis = redis_client
+        # tenant -> [month, locally reserved tokens]
+        self._reserved: Dict[str, list] = {}
 
     async def consume(self, tenant: str, tokens: int, cfg: Dict[str, Any]) -> bool:
         """Attempt to consume `tokens` from tenant's monthly cap.
@@ -56,34 +144,325 @@ class QuotaManager:
             True if consumption succeeded; False if cap would be exceeded.
         """
         cap = int(cfg.get("monthly_tokens", 100000))
-        return await quota_consume(self.redis, tenant, tokens, cap)
+        month = current_month()
+        entry = self._reserved.get(tenant)
+        if entry is not None and entry[0] != month:
+            # stale reservation from last month; the key has rolled over
+            entry = None
+            del self._reserved[tenant]
+        if entry is not None and entry[1] >= tokens:
+            entry[1] -= tokens
+            return True
+        # local pool exhausted: reserve a chunk in one round trip
+        leftover = entry[1] if entry is not None else 0
+        want = max(tokens - leftover, self.RESERVE_CHUNK)
+        if await quota_consume(self.redis, tenant, want, cap):
+            self._reserved[tenant] = [month, leftover + want - tokens]
+            return True
+        # near the cap a full chunk may not fit; fall back to the exact amount
+        if want > tokens - leftover and await quota_consume(self.redis, tenant, tokens - leftover, cap):
+            if entry is not None:
+                entry[1] = 0
+            return True
+        return False
+
+    async def close(self) -> None:
+        """Return all unspent local reservations to Redis.
+
+        Called at shutdown so tokens reserved but never consumed don't
+        count against the tenant for the rest of the month.
+        """
+        reserved, self._reserved = self._reserved, {}
+        for tenant, (month, tokens) in reserved.items():
+            if tokens > 0:
+                try:
+                    await quota_refund(self.redis, tenant, tokens, month)
+                except Exception:
+                    pass
 
 
-def redact_text(text: str, patterns: Optional[List[str]]) -> str:
-    """Redact occurrences matching regex patterns.
+class Redactor:
+    """A compiled PII redactor for one tenant.
 
-    For each pattern in `patterns` the function replaces matches with
-    the literal string `[REDACTED]`. Invalid regexes are treated as
-    plain substrings and replaced.
+    Holds a single unioned pattern (compiled with the selected engine),
+    a list of individually compiled patterns that can't join the union
+    (capturing groups/backreferences would be renumbered by it), and a
+    list of literal substrings for patterns the engine rejected.
     """
-    if not patterns:
+
+    def __init__(self, pattern, literals: List[str], singles: tuple = ()):
+        self.pattern = pattern
+        self.literals = literals
+        self.singles = singles
+
+    def redact(self, text: str) -> str:
+        if self.pattern is not None:
+            text = self.pattern.sub("[REDACTED]", text)
+        for single in self.singles:
+            text = single.sub("[REDACTED]", text)
+        for lit in self.literals:
+            text = text.replace(lit, "[REDACTED]")
         return text
-    out = text
+
+
+class HyperscanRedactor:
+    """Redactor backed by a Hyperscan block-mode database.
+
+    All of a tenant's patterns compile into a single streaming DFA with
+    SIMD-accelerated scanning; one scan collects every match span, the
+    spans are merged, and the output is rebuilt in a single pass.
+    Patterns Hyperscan rejects are handled by a chained fallback
+    redactor.
+    """
+
+    def __init__(self, db, fallback: Optional["Redactor"]):
+        self.db = db
+        self.fallback = fallback
+
+    def redact(self, text: str) -> str:
+        if self.db is not None:
+            data = text.encode("utf-8")
+            spans = []
+
+            def on_match(_id, start, end, _flags, _ctx):
+                spans.append((start, end))
+
+            self.db.scan(data, match_event_handler=on_match)
+            if spans:
+                spans.sort()
+                chunks = []
+                pos = 0
+                for start, end in spans:
+                    if end <= pos:
+                        continue  # contained in an already-redacted span
+                    if start > pos:
+                        chunks.append(data[pos:start])
+                        chunks.append(b"[REDACTED]")
+                    elif not chunks or chunks[-1] != b"[REDACTED]":
+                        chunks.append(b"[REDACTED]")
+                    pos = end
+                chunks.append(data[pos:])
+                text = b"".join(chunks).decode("utf-8", "replace")
+        if self.fallback is not None:
+            text = self.fallback.redact(text)
+        return text
+
+
+def _compile_re(patterns: List[str]) -> Redactor:
+    # invalid patterns are demoted to escaped literals before unioning;
+    # patterns that can't join the union stay individually compiled:
+    # capturing groups (joining would renumber them and break their
+    # backreferences) and patterns that only compile standalone, such as
+    # global inline flags like (?i)... which re rejects inside a group
+    parts = []
+    singles = []
     for p in patterns:
         try:
-            out = re.sub(p, "[REDACTED]", out, flags=re.IGNORECASE)
+            compiled = re.compile(p, re.IGNORECASE)
+        except re.error:
+            parts.append(f"(?:{re.escape(p)})")
+            continue
+        if compiled.groups:
+            singles.append(compiled)
+            continue
+        try:
+            re.compile(f"(?:{p})", re.IGNORECASE)
+        except re.error:
+            singles.append(compiled)
+            continue
+        parts.append(f"(?:{p})")
+    pattern = None
+    if parts:
+        try:
+            pattern = re.compile("|".join(parts), re.IGNORECASE)
         except re.error:
-            out = out.replace(p, "[REDACTED]")
-    return out
+            # a union of individually-valid patterns can still fail to
+            # compile; degrade to per-pattern application rather than
+            # letting policy load crash
+            singles.extend(re.compile(part, re.IGNORECASE) for part in parts)
+    return Redactor(pattern, [], tuple(singles))
 
 
-def audit_log(tenant: str, provider: str, model: str, prompt: str, response: str, path: str = "logs/audit.log"):
-    """Append a JSON line to the audit log.
+def _compile_re2(patterns: List[str]) -> Redactor:
+    # constructs RE2 rejects (backreferences, lookarounds) fall back to
+    # plain substring replacement
+    accepted = []
+    literals = []
+    for p in patterns:
+        try:
+            re2.compile(f"(?i)(?:{p})")
+        except Exception:
+            literals.append(p)
+        else:
+            accepted.append(p)
+    pattern = None
+    singles = []
+    if accepted:
+        try:
+            pattern = re2.compile("(?i)" + "|".join(f"(?:{p})" for p in accepted))
+        except Exception:
+            # a union of individually-valid patterns can still exceed
+            # RE2's program-size limit; degrade to per-pattern
+            # application rather than letting policy load crash
+            singles = [re2.compile(f"(?i)(?:{p})") for p in accepted]
+    return Redactor(pattern, literals, tuple(singles))
+
+
+def _compile_fallback(patterns: List[str]) -> Optional[Redactor]:
+    if not patterns:
+        return None
+    if re2 is not None:
+        return _compile_re2(patterns)
+    return _compile_re(patterns)
+
+
+def _compile_hyperscan(patterns: List[str]) -> HyperscanRedactor:
+    flags = (
+        hyperscan.HS_FLAG_CASELESS
+        | hyperscan.HS_FLAG_SOM_LEFTMOST
+        | hyperscan.HS_FLAG_UTF8
+    )
+    accepted = []
+    rejected = []
+    for p in patterns:
+        # validate individually so one bad pattern doesn't reject the set
+        try:
+            probe = hyperscan.Database()
+            probe.compile(expressions=[p.encode()], flags=[flags])
+        except Exception:
+            rejected.append(p)
+        else:
+            accepted.append(p.encode())
+    db = None
+    if accepted:
+        db = hyperscan.Database()
+        db.compile(
+            expressions=accepted,
+            ids=list(range(len(accepted))),
+            flags=[flags] * len(accepted),
+        )
+    return HyperscanRedactor(db, _compile_fallback(rejected))
+
+
+def compile_redactor(patterns: Optional[List[str]]):
+    """Compile a list of PII patterns into a single multi-pattern matcher.
+
+    All patterns are matched in one scan over the text instead of one
+    scan per pattern. The engine is the fastest one installed (or the
+    one forced via GATEWAY_REGEX_ENGINE): `hyperscan` compiles the set
+    into a SIMD-accelerated DFA, `re2` unions them into a linear-time
+    DFA alternation, and stdlib `re` unions them into one backtracking
+    alternation. Unsupported patterns degrade gracefully per engine
+    (hyperscan -> re2/re fallback chain, re2 -> substring replacement,
+    re -> escaped literal). Returns `None` when there is nothing to
+    redact.
+    """
+    if not patterns:
+        return None
+    if _REGEX_ENGINE == "hyperscan" and hyperscan is not None:
+        return _compile_hyperscan(patterns)
+    if _REGEX_ENGINE in ("hyperscan", "re2") and re2 is not None:
+        return _compile_re2(patterns)
+    return _compile_re(patterns)
 
-    This helper keeps the audit sink simple for the demo; in production
-    you'd forward events to a secure logging pipeline or SIEM.
+
+def redact_text(text: str, redactor: Optional[Redactor]) -> str:
+    """Redact occurrences matching a compiled redactor.
+
+    `redactor` is the `Redactor` produced by `compile_redactor`
+    (normally cached per tenant on the PolicyStore); matches are
+    replaced with the literal string `[REDACTED]`. A `None` redactor
+    (tenant has no patterns) is a no-op, avoiding a pointless scan.
+    """
+    if redactor is None:
+        return text
+    return redactor.redact(text)
+
+
+class AuditWriter:
+    """Buffered, non-blocking audit log writer.
+
+    Request handlers enqueue entries with `log()` (a non-blocking
+    put); a background task drains the queue into a buffered
+    append-mode file, flushing at most every `FLUSH_INTERVAL` seconds.
+    This keeps disk I/O off the request path and batches many entries
+    per write syscall. If the queue is full (disk badly behind),
+    entries are dropped and counted rather than stalling requests.
+
+    This keeps the audit sink simple for the demo; in production you'd
+    forward events to a secure logging pipeline or SIEM.
     """
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    entry = {"timestamp": int(time.time()), "tenant": tenant, "provider": provider, "model": model, "prompt": prompt, "response": response}
-    with open(path, "a") as f:
-        f.write(json.dumps(entry) + "\n")
+
+    FLUSH_INTERVAL = 0.2
+    QUEUE_MAX = 10_000
+    BUFFER_SIZE = 65536
+
+    def __init__(self, path: str = "logs/audit.log"):
+        self.path = path
+        self.queue: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize=self.QUEUE_MAX)
+        self.dropped = 0
+        self._fp = None
+        self._task = None
+
+    async def start(self) -> None:
+        """Open the log file and spawn the drain task (call at lifespan start)."""
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._fp = open(self.path, "ab", buffering=self.BUFFER_SIZE)
+        self._task = asyncio.create_task(self._drain())
+
+    def log(self, tenant: str, provider: str, model: str, prompt: str, response: str) -> None:
+        """Enqueue one audit entry without blocking the caller."""
+        entry = {"timestamp": int(time.time()), "tenant": tenant, "provider": provider, "model": model, "prompt": prompt, "response": response}
+        if orjson is not None:
+            line = orjson.dumps(entry) + b"\n"
+        else:
+            line = (json.dumps(entry) + "\n").encode()
+        try:
+            self.queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _drain(self) -> None:
+        last_flush = time.monotonic()
+        dirty = False
+        while True:
+            try:
+                line = await asyncio.wait_for(self.queue.get(), timeout=self.FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                if dirty:
+                    self._fp.flush()
+                    dirty = False
+                    last_flush = time.monotonic()
+                continue
+            self._fp.write(line)
+            # drain whatever else is already queued in the same batch
+            while True:
+                try:
+                    self._fp.write(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            dirty = True
+            now = time.monotonic()
+            if now - last_flush >= self.FLUSH_INTERVAL:
+                self._fp.flush()
+                dirty = False
+                last_flush = now
+
+    async def close(self) -> None:
+        """Stop the drain task and flush anything still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._fp is not None:
+            while True:
+                try:
+                    self._fp.write(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            self._fp.flush()
+            self._fp.close()
@@ -1,36 +1,160 @@
-from pydantic import BaseModel
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
 import yaml
-from typing import Dict, Any
+from typing import Any, Dict, FrozenSet, Optional
+
+try:
+    # libyaml-backed loader; several times faster than the pure-Python one
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+from gateway.middleware import compile_redactor
+
+# path -> (mtime, size, parsed dict). YAML parsing is slow; when a
+# reload hits a file that hasn't changed (same mtime and size) we reuse
+# the parsed dict instead of re-parsing. Small LRU, bounded at 100 files.
+_YAML_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_YAML_CACHE_MAX = 100
+
+
+@dataclass(frozen=True, slots=True)
+class RouteCfg:
+    """Preresolved configuration for one named route under a tenant.
+
+    Built once at policy load so the request path reads plain
+    attributes instead of chained dict lookups. `raw` keeps the
+    original route dict for anything not broken out.
+    """
+
+    name: str
+    upstream: Optional[str] = None
+    allow_methods: Optional[FrozenSet[str]] = None
+    rate_limit: Optional[Dict[str, Any]] = None
+    quota: Optional[Dict[str, Any]] = None
+    ai: bool = False
+    redact: bool = False
+    provider: Optional[str] = None
+    model: Optional[str] = None
+    raw: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass(frozen=True, slots=True)
+class TenantCfg:
+    """Preresolved configuration for one tenant.
+
+    Everything the per-request path needs — limits, quota, the compiled
+    PII redactor, provider credentials, routes, and the token set — is
+    resolved once at policy load. `raw` keeps the original tenant dict.
+    """
+
+    rate_limit: Dict[str, Any] = field(default_factory=dict)
+    quota: Dict[str, Any] = field(default_factory=dict)
+    pii_redactor: Any = None
+    default_provider: str = "ollama"
+    provider_credentials: Dict[str, Any] = field(default_factory=dict)
+    routes: Dict[str, RouteCfg] = field(default_factory=dict)
+    tokens: FrozenSet[str] = frozenset()
+    raw: Dict[str, Any] = field(default_factory=dict)
+
+
+# returned for unknown tenants so callers always get attribute access
+_EMPTY_TENANT = TenantCfg()
+
+
+def _build_route(name: str, rcfg: Dict[str, Any]) -> RouteCfg:
+    methods = rcfg.get("allow_methods")
+    if methods:
+        methods = frozenset(m.upper() for m in methods)
+    else:
+        methods = None
+    return RouteCfg(
+        name=name,
+        upstream=rcfg.get("upstream"),
+        allow_methods=methods,
+        rate_limit=rcfg.get("rate_limit"),
+        quota=rcfg.get("quota"),
+        ai=bool(rcfg.get("ai")),
+        redact=bool(rcfg.get("redact")),
+        provider=rcfg.get("provider"),
+        model=rcfg.get("model"),
+        raw=rcfg,
+    )
+
+
+def _build_tenant(cfg: Dict[str, Any]) -> TenantCfg:
+    routes = {name: _build_route(name, rcfg) for name, rcfg in (cfg.get("routes") or {}).items()}
+    return TenantCfg(
+        rate_limit=cfg.get("rate_limit") or {},
+        quota=cfg.get("quota") or {},
+        pii_redactor=compile_redactor(cfg.get("pii_patterns", [])),
+        default_provider=cfg.get("default_provider", "ollama"),
+        provider_credentials=cfg.get("provider_credentials") or {},
+        routes=routes,
+        tokens=frozenset(cfg.get("tokens") or []),
+        raw=cfg,
+    )
 
 
 class PolicyStore:
     def __init__(self, raw: Dict[str, Any]):
         self.raw = raw
+        # Derived structures are built eagerly: construction happens
+        # once per (re)load, and the request path then reads plain
+        # attributes and dict hits with no lazy-build branches.
+        self._tenants: Dict[str, TenantCfg] = {
+            name: _build_tenant(cfg) for name, cfg in (raw.get("tenants") or {}).items()
+        }
+        self._token_map: Dict[str, str] = {}
+        # flat (tenant, route) index so route resolution is one dict hit
+        self._routes: Dict[tuple, RouteCfg] = {}
+        for name, tenant in self._tenants.items():
+            for tok in tenant.tokens:
+                self._token_map[tok] = name
+            for route_name, route in tenant.routes.items():
+                self._routes[(name, route_name)] = route
 
     @classmethod
     def load(cls, path: str):
+        try:
+            st = os.stat(path)
+            sig = (st.st_mtime, st.st_size)
+        except OSError:
+            sig = None
+        if sig is not None:
+            cached = _YAML_CACHE.get(path)
+            if cached is not None and (cached[0], cached[1]) == sig:
+                _YAML_CACHE.move_to_end(path)
+                return cls(cached[2])
         with open(path, "r") as f:
-            raw = yaml.safe_load(f) or {}
+            raw = yaml.load(f, Loader=_Loader) or {}
+        if sig is not None:
+            _YAML_CACHE[path] = (sig[0], sig[1], raw)
+            _YAML_CACHE.move_to_end(path)
+            while len(_YAML_CACHE) > _YAML_CACHE_MAX:
+                _YAML_CACHE.popitem(last=False)
         return cls(raw)
 
-    def for_tenant(self, tenant: str) -> Dict[str, Any]:
-        return self.raw.get("tenants", {}).get(tenant, {})
+    def for_tenant(self, tenant: str) -> TenantCfg:
+        return self._tenants.get(tenant, _EMPTY_TENANT)
 
-    def route_for_tenant(self, tenant: str, route_name: str) -> Dict[str, Any]:
-        """Return route configuration for a named route under a tenant.
+    def route_for_tenant(self, tenant: str, route_name: str) -> Optional[RouteCfg]:
+        """Return the RouteCfg for a named route under a tenant.
 
         The policy YAML can declare a `routes:` mapping per tenant. Each
         route entry may contain `upstream`, `allow_methods`, `rate_limit`,
-        `quota`, and `ai` flags. This helper returns the route dict or an
-        empty dict if not found.
+        `quota`, and `ai` flags. Returns `None` if the route isn't
+        declared for the tenant.
         """
-        tenant_cfg = self.for_tenant(tenant)
-        return (tenant_cfg.get("routes", {}) or {}).get(route_name, {})
+        return self._routes.get((tenant, route_name))
+
+    def redactor_for_tenant(self, tenant: str):
+        """Return the compiled PII redactor for `tenant` (or None)."""
+        return self.for_tenant(tenant).pii_redactor
 
     def token_map(self) -> Dict[str, str]:
-        # returns token -> tenant mapping
-        mapping = {}
-        for t, cfg in (self.raw.get("tenants", {})).items():
-            for tok in cfg.get("tokens", []):
-                mapping[tok] = t
-        return mapping
+        # token -> tenant mapping; built once at construction so the
+        # auth hot path is a single dict lookup per request
+        return self._token_map
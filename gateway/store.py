@@ -3,11 +3,148 @@
 This module centralizes Redis client creation and small atomic helpers
 used by the gateway to enforce distributed rate limits and quotas.
 """
+import os
 import time
-from datetime import datetime
 import calendar
 from typing import Tuple
 import redis.asyncio as aioredis
+from redis.exceptions import NoScriptError
+
+# Debug aid: set GATEWAY_RATE_TTL_DEBUG=1 to report the retry-after from
+# the key's actual TTL (extra round trip on rejection) instead of
+# computing it from the local clock.
+_RATE_TTL_DEBUG = os.getenv("GATEWAY_RATE_TTL_DEBUG") == "1"
+
+
+# Fixed-window rate limit: INCR and set EXPIRE on first hit in one
+# atomic script so a check is a single round trip. The retry-after on
+# rejection is derived from the clock locally (the window boundary is
+# deterministic), so the script doesn't need a TTL probe.
+RATE_LUA = """
+local v = redis.call('INCR', KEYS[1])
+if v == 1 then redis.call('EXPIRE', KEYS[1], ARGV[2]) end
+return v
+"""
+
+# Token bucket: refill from elapsed time, deduct the request cost if
+# enough tokens remain, all in one atomic script. Uses a single hash
+# per tenant (vs. a fresh counter key every window) and returns
+# {allowed, retry_after_seconds}.
+BUCKET_LUA = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local per = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local cost = tonumber(ARGV[5])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil then tokens = burst; ts = now end
+tokens = math.min(burst, tokens + (now - ts) * rate / per)
+local allowed = 0
+local retry = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  retry = math.ceil((cost - tokens) * per / rate)
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst * per / rate) + 60)
+return {allowed, retry}
+"""
+
+# Borrowing variant of the token bucket: grants up to ARGV[5] whole
+# tokens in one round trip (at least 1, at most what the bucket holds)
+# so a replica can prepay a small batch and serve the next few checks
+# locally. Returns {granted, retry_after_seconds}.
+BUCKET_BORROW_LUA = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local per = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local want = tonumber(ARGV[5])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil then tokens = burst; ts = now end
+tokens = math.min(burst, tokens + (now - ts) * rate / per)
+local granted = 0
+local retry = 0
+if tokens >= 1 then
+  granted = math.min(math.floor(tokens), want)
+  tokens = tokens - granted
+else
+  retry = math.ceil((1 - tokens) * per / rate)
+end
+redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst * per / rate) + 60)
+return {granted, retry}
+"""
+
+# Monthly quota: check-and-increment must be atomic across replicas so
+# concurrent requests can't oversubscribe the cap. Returns -1 when the
+# increment would exceed the cap.
+QUOTA_LUA = """
+local key = KEYS[1]
+local tokens = tonumber(ARGV[1])
+local cap = tonumber(ARGV[2])
+local expire = tonumber(ARGV[3])
+local curr = redis.call('GET', key)
+if not curr then curr = 0 else curr = tonumber(curr) end
+if curr + tokens > cap then return -1 end
+local v = redis.call('INCRBY', key, tokens)
+redis.call('EXPIRE', key, expire)
+return v
+"""
+
+# Return unused reserved tokens, but only while the month key still
+# exists — recreating an expired key would give it no TTL.
+QUOTA_REFUND_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+  return redis.call('DECRBY', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+# script text -> sha cache; populated lazily by _eval_script
+_SCRIPT_SHAS = {}
+
+
+async def _eval_script(redis: aioredis.Redis, script: str, numkeys: int, *args):
+    """Run a Lua script via EVALSHA, loading it on first use.
+
+    Caches the sha per script text so steady-state calls send only the
+    40-byte sha instead of the full script body. If the server has lost
+    the script (restart, SCRIPT FLUSH) the NOSCRIPT error triggers a
+    reload and retry.
+    """
+    sha = _SCRIPT_SHAS.get(script)
+    if sha is None:
+        sha = await redis.script_load(script)
+        _SCRIPT_SHAS[script] = sha
+    try:
+        return await redis.evalsha(sha, numkeys, *args)
+    except NoScriptError:
+        _SCRIPT_SHAS[script] = await redis.script_load(script)
+        return await redis.evalsha(_SCRIPT_SHAS[script], numkeys, *args)
+
+
+async def preload_scripts(redis: aioredis.Redis) -> None:
+    """Load all Lua scripts into Redis and warm the sha cache.
+
+    Called once at application startup so the first requests don't pay
+    the SCRIPT LOAD round trip; `_eval_script` still handles NOSCRIPT
+    (server restart, SCRIPT FLUSH) by reloading on demand. All loads go
+    out in a single non-transactional pipeline.
+    """
+    scripts = [RATE_LUA, BUCKET_LUA, BUCKET_BORROW_LUA, QUOTA_LUA, QUOTA_REFUND_LUA]
+    async with redis.pipeline(transaction=False) as p:
+        for script in scripts:
+            p.script_load(script)
+        shas = await p.execute()
+    for script, sha in zip(scripts, shas):
+        _SCRIPT_SHAS[script] = sha
 
 
 def create_redis(url: str = "redis://localhost:6379/0") -> aioredis.Redis:
@@ -32,26 +169,87 @@ async def rate_allow(redis: aioredis.Redis, tenant: str, requests: int, per_seco
     Returns (allowed, retry_after_seconds).
     """
     now = int(time.time())
-    window = now // max(1, per_seconds)
+    per_seconds = max(1, per_seconds)
+    window = now // per_seconds
     key = f"rl:{tenant}:{window}"
-    # INCR and set EXPIRE if first seen
-    val = await redis.incr(key)
-    if val == 1:
-        await redis.expire(key, per_seconds)
+    val = await _eval_script(redis, RATE_LUA, 1, key, requests, per_seconds)
     if val > requests:
-        ttl = await redis.ttl(key)
-        retry = ttl if ttl and ttl > 0 else per_seconds
+        if _RATE_TTL_DEBUG:
+            ttl = await redis.ttl(key)
+            retry = ttl if ttl and ttl > 0 else per_seconds
+        else:
+            # seconds until the current window rolls over
+            retry = per_seconds - (now % per_seconds)
         return False, retry
     return True, 0
 
 
-def _seconds_until_month_end() -> int:
-    now = datetime.utcnow()
-    year = now.year
-    month = now.month
-    last_day = calendar.monthrange(year, month)[1]
-    end = datetime(year, month, last_day, 23, 59, 59)
-    return int((end - now).total_seconds())
+async def token_bucket_allow(redis: aioredis.Redis, tenant: str, rate: int, per_seconds: int, burst: int, cost: int = 1) -> Tuple[bool, int]:
+    """Check a token-bucket limit of `rate` tokens per `per_seconds`.
+
+    The bucket refills continuously and holds at most `burst` tokens,
+    so short bursts up to `burst` are allowed but the sustained rate is
+    bounded — without the 2x edge bursts a fixed window permits at
+    window boundaries. One hash key per tenant (refreshed TTL) instead
+    of a new counter key per window, and still one round trip per check.
+
+    Returns (allowed, retry_after_seconds).
+    """
+    key = f"tb:{tenant}"
+    allowed, retry = await _eval_script(
+        redis, BUCKET_LUA, 1, key, burst, rate, per_seconds, time.time(), cost
+    )
+    return bool(allowed), int(retry)
+
+
+async def token_bucket_borrow(redis: aioredis.Redis, tenant: str, rate: int, per_seconds: int, burst: int, want: int) -> Tuple[int, int]:
+    """Borrow up to `want` whole tokens from the tenant's bucket.
+
+    Grants whatever the bucket can cover (capped at `want`), or zero
+    with a retry hint when the bucket is empty. Used by the local fast
+    path in `RateLimiter` to amortize one round trip over several
+    requests.
+
+    Returns (granted_tokens, retry_after_seconds).
+    """
+    key = f"tb:{tenant}"
+    granted, retry = await _eval_script(
+        redis, BUCKET_BORROW_LUA, 1, key, burst, rate, per_seconds, time.time(), want
+    )
+    return int(granted), int(retry)
+
+
+# (month_str, month_end_ts, expire_seconds, computed_at); both quota
+# helpers need the current month and its expiry on every request, so
+# cache the calendar math for up to 60s (and always recompute once the
+# cached month has actually ended)
+_MONTH_CACHE = None
+
+
+def _month_info() -> Tuple[str, int]:
+    """Return (current UTC month 'YYYY-MM', quota key expire seconds).
+
+    The expire includes a one-day cushion past month end so old keys
+    disappear on their own. Results are cached for up to 60 seconds to
+    keep datetime formatting off the hot path.
+    """
+    global _MONTH_CACHE
+    now = time.time()
+    cached = _MONTH_CACHE
+    if cached is not None and now - cached[3] < 60 and now < cached[1]:
+        return cached[0], cached[2]
+    tm = time.gmtime(now)
+    last_day = calendar.monthrange(tm.tm_year, tm.tm_mon)[1]
+    end = calendar.timegm((tm.tm_year, tm.tm_mon, last_day, 23, 59, 59, 0, 0, 0))
+    month = f"{tm.tm_year:04d}-{tm.tm_mon:02d}"
+    expire = int(end - now) + 60 * 60 * 24
+    _MONTH_CACHE = (month, end, expire, now)
+    return month, expire
+
+
+def current_month() -> str:
+    """Return the current UTC month as 'YYYY-MM' (quota key suffix)."""
+    return _month_info()[0]
 
 
 async def quota_consume(redis: aioredis.Redis, tenant: str, tokens: int, cap: int) -> bool:
@@ -61,24 +259,19 @@ async def quota_consume(redis: aioredis.Redis, tenant: str, tokens: int, cap: in
     processes. If the increment would exceed `cap`, the script returns -1
     and we return False. Otherwise returns True.
     """
-    key = f"quota:{tenant}:{time.strftime('%Y-%m')}"
-    # Expire key after month end plus a cushion (so old keys disappear)
-    expire_seconds = _seconds_until_month_end() + 60 * 60 * 24
-
-    lua = """
-    local key = KEYS[1]
-    local tokens = tonumber(ARGV[1])
-    local cap = tonumber(ARGV[2])
-    local expire = tonumber(ARGV[3])
-    local curr = redis.call('GET', key)
-    if not curr then curr = 0 else curr = tonumber(curr) end
-    if curr + tokens > cap then return -1 end
-    local v = redis.call('INCRBY', key, tokens)
-    redis.call('EXPIRE', key, expire)
-    return v
-    """
-
-    res = await redis.eval(lua, 1, key, tokens, cap, expire_seconds)
+    month, expire_seconds = _month_info()
+    key = f"quota:{tenant}:{month}"
+    res = await _eval_script(redis, QUOTA_LUA, 1, key, tokens, cap, expire_seconds)
     if isinstance(res, (int,)) and res == -1:
         return False
     return True
+
+
+async def quota_refund(redis: aioredis.Redis, tenant: str, tokens: int, month: str) -> None:
+    """Return unused reserved tokens to a tenant's monthly quota.
+
+    Only decrements if the month key still exists (it may have expired
+    after a month rollover, in which case there is nothing to return).
+    """
+    key = f"quota:{tenant}:{month}"
+    await _eval_script(redis, QUOTA_REFUND_LUA, 1, key, tokens)
@@ -3,6 +3,7 @@
 Tries to use `tiktoken` for accurate token counting (OpenAI-compatible).
 Falls back to a simple word-based estimator if `tiktoken` isn't available.
 """
+from functools import lru_cache
 from typing import Optional
 
 try:
@@ -12,17 +13,29 @@ except Exception:
     tiktoken = None
     _ENC = None
 
+# only cache counts for short texts so the cache stays small; longer
+# prompts are unlikely to repeat exactly anyway
+_CACHE_MAX_CHARS = 1024
+
+
+@lru_cache(maxsize=4096)
+def _cached_count(text: str) -> int:
+    return len(_ENC.encode_ordinary(text))
+
 
 def estimate_tokens(text: str, model: Optional[str] = None) -> int:
     """Estimate token count for `text`.
 
     If `tiktoken` is available, use the `cl100k_base` encoding which
-    works for many OpenAI models. Otherwise fall back to a conservative
-    word-splitting heuristic.
+    works for many OpenAI models; repeated short texts (templates, test
+    traffic) hit an LRU cache instead of re-tokenizing. Otherwise fall
+    back to a conservative word-splitting heuristic.
     """
     if _ENC is not None:
         try:
-            return len(_ENC.encode(text))
+            if len(text) <= _CACHE_MAX_CHARS:
+                return _cached_count(text)
+            return len(_ENC.encode_ordinary(text))
         except Exception:
             pass
 
@@ -1,22 +1,47 @@
 
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import httpx
 import os
 import yaml
 
+try:
+    # libyaml-backed loader/dumper; several times faster than pure Python
+    from yaml import CSafeLoader as _YamlLoader, CSafeDumper as _YamlDumper
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader, SafeDumper as _YamlDumper
+
 from gateway.policy import PolicyStore
 from gateway.auth import get_tenant_from_token
-from gateway.middleware import RateLimiter, QuotaManager, redact_text, audit_log
+from gateway.middleware import RateLimiter, QuotaManager, AuditWriter, redact_text
 from gateway.providers import call_provider
-from gateway.store import create_redis
+from gateway.store import create_redis, preload_scripts
 from gateway.tokenizer import estimate_tokens
 
 
 POLICY_FILE = "policies/example_policy.yaml"
 
+# default when a route doesn't restrict methods
+_ALL_METHODS = frozenset({"GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+
+# headers never forwarded upstream: hop-by-hop headers plus our own
+# host/auth/body-framing headers
+_HOP_HEADERS = frozenset({
+    "host",
+    "authorization",
+    "content-length",
+    "connection",
+    "keep-alive",
+    "transfer-encoding",
+    "te",
+    "trailer",
+    "upgrade",
+    "proxy-authorization",
+    "proxy-authenticate",
+})
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -29,10 +54,38 @@ async def lifespan(app: FastAPI):
     app.state.policies = PolicyStore.load(POLICY_FILE)
     redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
     app.state.redis = create_redis(redis_url)
+    try:
+        await preload_scripts(app.state.redis)
+    except Exception:
+        # Redis may not be reachable yet; scripts load lazily on first use
+        pass
     app.state.rate_limiter = RateLimiter(app.state.redis)
     app.state.quota_mgr = QuotaManager(app.state.redis)
+    # audit directory is created once here (in AuditWriter.start), not
+    # per request; path is configurable for deployments
+    app.state.audit = AuditWriter(os.getenv("AUDIT_LOG_PATH", "logs/audit.log"))
+    await app.state.audit.start()
+    # one shared HTTP client so provider/proxy calls reuse pooled
+    # connections (and HTTP/2 multiplexing) instead of handshaking per call
+    app.state.http = httpx.AsyncClient(
+        timeout=30,
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=200, max_connections=500),
+    )
     yield
+    try:
+        await app.state.http.aclose()
+    except Exception:
+        pass
+    try:
+        await app.state.audit.close()
+    except Exception:
+        pass
     # optional cleanup
+    try:
+        await app.state.quota_mgr.close()
+    except Exception:
+        pass
     try:
         await app.state.redis.close()
     except Exception:
@@ -59,25 +112,55 @@ async def generate(req: GenerateRequest, request: Request):
 
     policy = app.state.policies.for_tenant(tenant)
 
-    allowed, retry_after = await app.state.rate_limiter.allow(tenant, policy.get("rate_limit", {}))
+    allowed, retry_after = await app.state.rate_limiter.allow(tenant, policy.rate_limit)
     if not allowed:
         raise HTTPException(status_code=429, detail=f"rate limit exceeded, retry after {retry_after}s")
     # estimate tokens using tokenizer helper (tiktoken when available)
     estimated_tokens = estimate_tokens(req.prompt, model=req.model)
-    if not await app.state.quota_mgr.consume(tenant, estimated_tokens, policy.get("quota", {})):
+    if not await app.state.quota_mgr.consume(tenant, estimated_tokens, policy.quota):
         raise HTTPException(status_code=402, detail="quota exceeded")
 
-    redacted_prompt = redact_text(req.prompt, policy.get("pii_patterns", []))
+    # resolve the compiled redactor once for both the prompt and response
+    redactor = policy.pii_redactor
+    redacted_prompt = redact_text(req.prompt, redactor)
 
-    resp = await call_provider(provider=req.provider, model=req.model, prompt=redacted_prompt, tenant=tenant, policy=policy)
+    resp = await call_provider(provider=req.provider, model=req.model, prompt=redacted_prompt, tenant=tenant, policy=policy, client=app.state.http)
 
-    redacted_response = redact_text(resp, policy.get("pii_patterns", []))
+    redacted_response = redact_text(resp, redactor)
 
-    audit_log(tenant, req.provider, req.model, redacted_prompt, redacted_response)
+    app.state.audit.log(tenant, req.provider, req.model, redacted_prompt, redacted_response)
 
     return {"tenant": tenant, "provider": req.provider, "model": req.model, "response": redacted_response}
 
 
+# how much of a proxied response body is captured for the audit log
+_AUDIT_PREVIEW_BYTES = 1000
+
+
+def _stream_upstream(r: httpx.Response, tenant: str, target: str, summary: str) -> StreamingResponse:
+    """Stream an upstream response straight through to the client.
+
+    The body is relayed chunk by chunk (raw bytes, so compressed
+    payloads pass through untouched) without ever materializing it in
+    memory; only the first `_AUDIT_PREVIEW_BYTES` are captured for the
+    audit entry, which is written once the stream finishes.
+    """
+
+    async def body_stream():
+        preview = b""
+        try:
+            async for chunk in r.aiter_raw():
+                if len(preview) < _AUDIT_PREVIEW_BYTES:
+                    preview += chunk[: _AUDIT_PREVIEW_BYTES - len(preview)]
+                yield chunk
+        finally:
+            await r.aclose()
+            app.state.audit.log(tenant, "proxy", target, summary, preview.decode("utf-8", "replace"))
+
+    headers = {k: v for k, v in r.headers.items() if k not in _HOP_HEADERS}
+    return StreamingResponse(body_stream(), status_code=r.status_code, headers=headers)
+
+
 class ProxyRequest(BaseModel):
     method: str
     url: str
@@ -100,18 +183,15 @@ async def proxy(req: ProxyRequest, request: Request):
 
     policy = app.state.policies.for_tenant(tenant)
 
-    allowed, retry_after = await app.state.rate_limiter.allow(tenant, policy.get("rate_limit", {}))
+    allowed, retry_after = await app.state.rate_limiter.allow(tenant, policy.rate_limit)
     if not allowed:
         raise HTTPException(status_code=429, detail=f"rate limit exceeded, retry after {retry_after}s")
 
-    # forward request
-    async with httpx.AsyncClient(timeout=30) as c:
-        headers = req.headers or {}
-        r = await c.request(req.method.upper(), req.url, headers=headers, content=req.body)
-
-    # audit the proxied request (do NOT log auth headers)
-    audit_log(tenant, "proxy", req.url, f"{req.method} {req.url}", r.text[:1000])
-    return {"status_code": r.status_code, "headers": dict(r.headers), "body": r.text}
+    # forward request, streaming the upstream body straight through
+    headers = req.headers or {}
+    upstream_req = app.state.http.build_request(req.method.upper(), req.url, headers=headers, content=req.body)
+    r = await app.state.http.send(upstream_req, stream=True)
+    return _stream_upstream(r, tenant, req.url, f"{req.method} {req.url}")
 
 
 @app.api_route("/v1/route/{route_name}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
@@ -137,46 +217,50 @@ async def route_forward(route_name: str, path: str = "", request: Request = None
 
     policy = app.state.policies.for_tenant(tenant)
     route_cfg = app.state.policies.route_for_tenant(tenant, route_name)
-    if not route_cfg:
+    if route_cfg is None:
         raise HTTPException(404, "route not found")
 
     # method allow check
     method = request.method.upper()
-    allow_methods = route_cfg.get("allow_methods") or ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+    allow_methods = route_cfg.allow_methods or _ALL_METHODS
     if method not in allow_methods:
         raise HTTPException(405, "method not allowed for this route")
 
     # rate limiting (route-level overrides tenant-level)
-    rl_cfg = route_cfg.get("rate_limit", policy.get("rate_limit", {}))
+    rl_cfg = route_cfg.rate_limit if route_cfg.rate_limit is not None else policy.rate_limit
     allowed, retry_after = await app.state.rate_limiter.allow(tenant, rl_cfg)
     if not allowed:
         raise HTTPException(status_code=429, detail=f"rate limit exceeded, retry after {retry_after}s")
 
     # AI-enabled route
-    if route_cfg.get("ai"):
+    if route_cfg.ai:
         body = await request.json()
         prompt = body.get("prompt")
         if not prompt:
             raise HTTPException(400, "ai routes expect JSON body with 'prompt' field")
 
+        # resolve the compiled redactor once for both the prompt and response
+        redactor = policy.pii_redactor
+
         # apply PII redaction if requested by route
-        if route_cfg.get("redact"):
-            prompt = redact_text(prompt, policy.get("pii_patterns", []))
+        if route_cfg.redact:
+            prompt = redact_text(prompt, redactor)
 
         # token estimation and quota (use tokenizer for accuracy)
-        estimated_tokens = estimate_tokens(prompt, model=route_cfg.get("model"))
-        if not await app.state.quota_mgr.consume(tenant, estimated_tokens, route_cfg.get("quota", policy.get("quota", {}))):
+        estimated_tokens = estimate_tokens(prompt, model=route_cfg.model)
+        quota_cfg = route_cfg.quota if route_cfg.quota is not None else policy.quota
+        if not await app.state.quota_mgr.consume(tenant, estimated_tokens, quota_cfg):
             raise HTTPException(status_code=402, detail="quota exceeded")
 
-        provider = route_cfg.get("provider") or policy.get("default_provider", "ollama")
-        model = route_cfg.get("model")
-        resp = await call_provider(provider=provider, model=model, prompt=prompt, tenant=tenant, policy=policy)
-        redacted_resp = redact_text(resp, policy.get("pii_patterns", []))
-        audit_log(tenant, provider, model, prompt, redacted_resp)
+        provider = route_cfg.provider or policy.default_provider
+        model = route_cfg.model
+        resp = await call_provider(provider=provider, model=model, prompt=prompt, tenant=tenant, policy=policy, client=app.state.http)
+        redacted_resp = redact_text(resp, redactor)
+        app.state.audit.log(tenant, provider, model, prompt, redacted_resp)
         return JSONResponse({"tenant": tenant, "route": route_name, "response": redacted_resp})
 
     # Proxy behavior: forward to upstream + path
-    upstream = route_cfg.get("upstream")
+    upstream = route_cfg.upstream
     if not upstream:
         raise HTTPException(500, "route misconfigured: missing upstream")
 
@@ -186,14 +270,16 @@ async def route_forward(route_name: str, path: str = "", request: Request = None
     if qs:
         upstream_url = upstream_url + "?" + qs
 
-    # forward headers (strip hop-by-hop and auth)
-    headers = {k: v for k, v in request.headers.items() if k.lower() not in ("host", "authorization", "content-length")}
+    # forward headers (strip hop-by-hop and auth); httpx.Headers keeps
+    # the raw bytes and lowercases once, instead of a per-header
+    # .lower() plus dict comprehension
+    headers = httpx.Headers(request.headers.raw)
+    for h in _HOP_HEADERS:
+        headers.pop(h, None)
     body = await request.body()
-    async with httpx.AsyncClient(timeout=30) as c:
-        r = await c.request(method, upstream_url, headers=headers, content=body)
-
-    audit_log(tenant, "proxy", upstream_url, f"{method} {upstream_url}", r.text[:1000])
-    return JSONResponse(status_code=r.status_code, content={"headers": dict(r.headers), "body": r.text})
+    upstream_req = app.state.http.build_request(method, upstream_url, headers=headers, content=body)
+    r = await app.state.http.send(upstream_req, stream=True)
+    return _stream_upstream(r, tenant, upstream_url, f"{method} {upstream_url}")
 
 
 @app.post("/admin/reload_policies")
@@ -225,7 +311,7 @@ async def update_policies(request: Request):
 
     try:
         # attempt YAML parse which also accepts JSON
-        parsed = yaml.safe_load(body)
+        parsed = yaml.load(body, Loader=_YamlLoader)
     except Exception as exc:
         raise HTTPException(400, f"unable to parse body as YAML/JSON: {exc}")
 
@@ -235,7 +321,7 @@ async def update_policies(request: Request):
     # persist to disk
     try:
         with open(POLICY_FILE, "w") as f:
-            yaml.safe_dump(parsed, f)
+            yaml.dump(parsed, f, Dumper=_YamlDumper)
     except Exception as exc:
         raise HTTPException(500, f"failed to write policy file: {exc}")
 